@@ -1,32 +1,124 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request, Response, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from typing import List, Optional, Dict, Any
-from datetime import datetime, timedelta
-import json
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+import msgspec
+from typing import Annotated, List, Optional, Dict, Any
+from datetime import datetime, timedelta, timezone
+import orjson
 import os
-import uuid
+import itertools
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import random
+import weakref
+from cachetools import TTLCache
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
 from dotenv import load_dotenv
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 import hashlib
+import hmac
+import jwt
+import secrets
 import time
 
 # Load environment variables
 load_dotenv()
 
-app = FastAPI(title="AI Quiz Pro API", version="1.0.0")
+app = FastAPI(title="AI Quiz Pro API", version="1.0.0", default_response_class=ORJSONResponse)
 
 # MongoDB setup
 MONGO_URL = os.environ.get("MONGO_URL")
 DB_NAME = os.environ.get("DB_NAME", "quiz_pro_db")
 EMERGENT_LLM_KEY = os.environ.get("EMERGENT_LLM_KEY")
+LLM_PROVIDER = "openai"
+LLM_MODEL = "gpt-4o-mini"
+# Shared by every worker so tokens verify regardless of which process issued them
+JWT_SECRET = os.environ["JWT_SECRET"]
+TOKEN_TTL_SECONDS = 86400
 
-client = AsyncIOMotorClient(MONGO_URL)
+# Pool sizes are per worker process; keep MONGO_MAX_POOL_SIZE * workers under the server's connection limit
+client = AsyncIOMotorClient(
+    MONGO_URL,
+    maxPoolSize=int(os.environ.get("MONGO_MAX_POOL_SIZE", "50")),
+    minPoolSize=int(os.environ.get("MONGO_MIN_POOL_SIZE", "5")),
+    waitQueueTimeoutMS=2000,
+    serverSelectionTimeoutMS=3000,
+    compressors="zstd,zlib"
+)
 db = client[DB_NAME]
 
+# Projections for user lookups on the auth paths
+USER_PROFILE_PROJECTION = {
+    "_id": 0, "user_id": 1, "email": 1, "full_name": 1, "total_points": 1,
+    "wallet_balance": 1, "total_quizzes": 1, "correct_answers": 1
+}
+USER_LOGIN_PROJECTION = {
+    "_id": 0, "user_id": 1, "email": 1, "password": 1, "salt": 1,
+    "full_name": 1, "total_points": 1, "wallet_balance": 1
+}
+
+# Quiz scoring
+POINTS_MAP = {"Easy": 10, "Medium": 20, "Hard": 30}
+TIME_PER_QUESTION = 30  # seconds
+MAX_QUESTIONS_PER_QUIZ = 20
+HIDDEN_QUESTION_FIELDS = ("correct_answer", "explanation")
+
+# The categories payload is constant, so it is serialized once at import time
+CATEGORIES_BYTES = orjson.dumps({
+    "categories": [
+        "General Knowledge",
+        "Science & Technology", 
+        "History",
+        "Geography",
+        "Sports",
+        "Entertainment",
+        "Literature",
+        "Mathematics",
+        "Current Affairs",
+        "Art & Culture"
+    ]
+})
+CATEGORIES_HEADERS = {
+    "ETag": f'"{hashlib.md5(CATEGORIES_BYTES).hexdigest()}"',
+    "Cache-Control": "public, max-age=86400"
+}
+
+# Short-lived cache of authenticated user documents keyed by user_id
+user_cache = TTLCache(maxsize=10_000, ttl=30)
+
+# Generated question sets keyed by (category, difficulty, num_questions)
+QUIZ_CACHE_MIN_SETS = 3
+QUIZ_CACHE_MAX_SETS = 64
+# Chance that a cache hit also tops the bucket up in the background, so pools keep
+# growing towards QUIZ_CACHE_MAX_SETS instead of repeating the first few sets
+QUIZ_CACHE_REFILL_PROBABILITY = float(os.environ.get("QUIZ_CACHE_REFILL_PROBABILITY", "0.25"))
+# Each set expires on its own, QUIZ_SET_TTL_SECONDS after it was generated, so a full
+# bucket drains gradually and refills instead of expiring all at once. Buckets hold
+# (expires_at, questions) pairs and are re-assigned on every change, which refreshes the
+# bucket's own TTL; that TTL only reclaims buckets nobody has touched for a while.
+QUIZ_SET_TTL_SECONDS = 3600
+quiz_cache = TTLCache(maxsize=512, ttl=QUIZ_SET_TTL_SECONDS)
+# Weak values: a lock stays alive for as long as any request holds or waits on it
+quiz_cache_locks = weakref.WeakValueDictionary()
+quiz_cache_refills = set()
+# Buckets whose last generation hit a provider outage are served fallback questions until this expires
+quiz_generation_failures = TTLCache(maxsize=512, ttl=30)
+
+# Each LLM call returns several question sets to warm the cache, bounded by the output token budget
+QUIZ_VARIANTS_PER_CALL = int(os.environ.get("QUIZ_VARIANTS_PER_CALL", "3"))
+LLM_MAX_OUTPUT_TOKENS = 2048
+TOKENS_PER_QUESTION = 80
+
+# LLM sessions are one-shot, so a per-process counter is enough to keep their ids distinct
+llm_session_counter = itertools.count(1)
+
+# Cap in-flight LLM calls so bursts don't run into provider rate limits
+llm_semaphore = asyncio.Semaphore(int(os.environ.get("LLM_MAX_CONCURRENCY", "8")))
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -36,68 +128,181 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress larger JSON payloads (quizzes, results); small responses skip it via minimum_size
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=4)
+
 security = HTTPBearer()
 
-# Pydantic models
-class UserRegistration(BaseModel):
+# App-wide counters served by /api/stats, refreshed in the background
+STATS_REFRESH_SECONDS = 30
+app_stats = {"total_users": 0, "total_quizzes": 0, "ts": 0}
+background_tasks = set()
+
+# scrypt is CPU-bound and releases the GIL, so password work runs on a small thread pool
+password_pool = ThreadPoolExecutor(max_workers=4)
+
+# Request bodies
+class UserRegistration(msgspec.Struct):
     email: str
     password: str
     full_name: str
 
-class UserLogin(BaseModel):
+class UserLogin(msgspec.Struct):
     email: str
     password: str
 
-class QuizRequest(BaseModel):
+class QuizRequest(msgspec.Struct):
     category: str
     difficulty: str
-    num_questions: int = 5
+    num_questions: Annotated[int, msgspec.Meta(ge=1, le=MAX_QUESTIONS_PER_QUIZ)] = 5
 
-class QuizAnswer(BaseModel):
+class QuizAnswer(msgspec.Struct):
     question_id: str
     selected_answer: int
     time_taken: float
 
-class QuizSubmission(BaseModel):
+class QuizSubmission(msgspec.Struct):
     quiz_id: str
     answers: List[QuizAnswer]
 
+def json_body(model: type):
+    """Dependency that decodes and validates the raw request body into a msgspec Struct"""
+    async def decode(request: Request):
+        try:
+            return msgspec.json.decode(await request.body(), type=model)
+        except msgspec.DecodeError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    return decode
+
 # Utility functions
-def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode()).hexdigest()
+def hash_password(password: str, salt: bytes) -> str:
+    return hashlib.scrypt(password.encode(), salt=salt, n=2**14, r=8, p=1, dklen=32).hex()
+
+def verify_password(password: str, user: dict) -> bool:
+    salt = user.get("salt")
+    if salt is None:
+        # Legacy accounts were stored as a bare SHA-256 digest
+        expected = hashlib.sha256(password.encode()).hexdigest()
+    else:
+        expected = hash_password(password, bytes.fromhex(salt))
+    return hmac.compare_digest(user["password"], expected)
+
+async def run_password_task(func, *args):
+    """Run a scrypt hash or verification on the password pool so the event loop stays free"""
+    return await asyncio.get_running_loop().run_in_executor(password_pool, func, *args)
 
 def generate_token(user_id: str) -> str:
-    return f"token_{user_id}_{int(time.time())}"
+    return jwt.encode({"uid": user_id, "exp": int(time.time()) + TOKEN_TTL_SECONDS}, JWT_SECRET, algorithm="HS256")
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    token = credentials.credentials
-    if not token.startswith("token_"):
+async def get_current_user_id(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
+    try:
+        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=["HS256"])
+    except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
-    
-    user_id = token.split("_")[1]
-    user = await db.users.find_one({"user_id": user_id})
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found")
+    return payload["uid"]
+
+async def get_current_user(user_id: str = Depends(get_current_user_id)):
+    user = user_cache.get(user_id)
+    if user is None:
+        user = await db.users.find_one({"user_id": user_id}, USER_PROFILE_PROJECTION)
+        if not user:
+            raise HTTPException(status_code=401, detail="User not found")
+        user_cache[user_id] = user
     return user
 
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """If-None-Match uses weak comparison (RFC 9110 13.1.2): W/ prefixes are ignored"""
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        candidate.strip().removeprefix("W/") == etag
+        for candidate in if_none_match.split(",")
+    )
+
+async def aenumerate(aiterable, start: int = 0):
+    i = start
+    async for item in aiterable:
+        yield i, item
+        i += 1
+
 # AI Quiz Generation
-async def generate_quiz_questions(category: str, difficulty: str, num_questions: int):
-    try:
-        chat = LlmChat(
-            api_key=EMERGENT_LLM_KEY,
-            session_id=f"quiz_{uuid.uuid4()}",
-            system_message=f"""You are an AI quiz generator. Generate exactly {num_questions} multiple-choice questions for the category '{category}' at '{difficulty}' difficulty level.
+def new_llm_chat(system_message: str) -> LlmChat:
+    # LlmChat is a lightweight per-conversation wrapper; the HTTP transport underneath is
+    # pooled by the provider client, so only the session state is created per call
+    return LlmChat(
+        api_key=EMERGENT_LLM_KEY,
+        session_id=f"quiz_{os.getpid()}_{next(llm_session_counter)}",
+        system_message=system_message
+    ).with_model(LLM_PROVIDER, LLM_MODEL)
+
+def is_transient_llm_error(exc: BaseException) -> bool:
+    """Timeouts, connection failures, rate limits and provider 5xx are worth retrying"""
+    if not isinstance(exc, Exception):
+        return False
+    if isinstance(exc, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    status_code = getattr(exc, "status_code", None)
+    if status_code is None:
+        status_code = getattr(getattr(exc, "response", None), "status_code", None)
+    return isinstance(status_code, int) and (status_code in (408, 429) or status_code >= 500)
+
+@retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=0.5, max=8),
+    retry=retry_if_exception(is_transient_llm_error),
+    reraise=True,
+)
+async def send_llm_message(chat: LlmChat, user_message: UserMessage) -> str:
+    async with llm_semaphore:
+        return await chat.send_message(user_message)
+
+def is_valid_question(q: Any) -> bool:
+    """Check a generated question has everything submit_quiz relies on"""
+    if not isinstance(q, dict):
+        return False
+    options = q.get("options")
+    correct_answer = q.get("correct_answer")
+    return (
+        isinstance(q.get("question"), str)
+        and isinstance(options, list) and len(options) == 4
+        and all(isinstance(o, str) for o in options)
+        and isinstance(correct_answer, int) and not isinstance(correct_answer, bool)
+        and 0 <= correct_answer <= 3
+        and isinstance(q.get("explanation"), str)
+    )
+
+def split_question_sets(parsed: Any, num_questions: int) -> List[List[dict]]:
+    """Extract the complete question sets from a parsed LLM response"""
+    if not isinstance(parsed, list) or not parsed:
+        raise ValueError("Response is not a list")
+    if all(isinstance(q, dict) for q in parsed):
+        # The model ignored the grouping and returned a flat list of questions
+        parsed = [parsed[i:i + num_questions] for i in range(0, len(parsed), num_questions)]
+    sets = [
+        v for v in parsed
+        if isinstance(v, list) and len(v) == num_questions and all(is_valid_question(q) for q in v)
+    ]
+    if not sets:
+        raise ValueError("Response contains no complete question set")
+    return sets
+
+async def request_quiz_questions(category: str, difficulty: str, num_questions: int):
+    """Ask the LLM for several independent question sets in a single call"""
+    num_variants = max(1, min(QUIZ_VARIANTS_PER_CALL, LLM_MAX_OUTPUT_TOKENS // (num_questions * TOKENS_PER_QUESTION)))
+    chat = new_llm_chat(f"""You are an AI quiz generator. Generate exactly {num_variants * num_questions} multiple-choice questions for the category '{category}' at '{difficulty}' difficulty level, grouped as {num_variants} arrays of length {num_questions}, wrapped in a top-level JSON array. Questions must not repeat across arrays.
 
 IMPORTANT: Return ONLY a valid JSON array with this exact format:
 [
-  {{
-    "id": "q1",
-    "question": "Question text here?",
-    "options": ["Option A", "Option B", "Option C", "Option D"],
-    "correct_answer": 0,
-    "explanation": "Brief explanation why this is correct",
-    "points": 10
-  }}
+  [
+    {{
+      "id": "q1",
+      "question": "Question text here?",
+      "options": ["Option A", "Option B", "Option C", "Option D"],
+      "correct_answer": 0,
+      "explanation": "Brief explanation why this is correct",
+      "points": 10
+    }}
+  ]
 ]
 
 Rules:
@@ -105,38 +310,92 @@ Rules:
 - correct_answer should be index (0-3) of the correct option
 - Points: Easy=10, Medium=20, Hard=30
 - Questions should be educational and factual
-- No markdown, no extra text, just the JSON array"""
-        ).with_model("openai", "gpt-4o-mini")
+- No markdown, no extra text, just the JSON array""")
 
-        user_message = UserMessage(text=f"Generate {num_questions} {difficulty} level questions about {category}")
-        response = await chat.send_message(user_message)
+    user_message = UserMessage(text=f"Generate {num_variants} sets of {num_questions} {difficulty} level questions about {category}")
+    response = await send_llm_message(chat, user_message)
+    
+    # Parse the AI response
+    variants = split_question_sets(orjson.loads(response), num_questions)
+    
+    # Assign points based on difficulty
+    base_fields = {"points": POINTS_MAP.get(difficulty, 10), "category": category, "difficulty": difficulty}
+    for questions in variants:
+        for q in questions:
+            q.update(base_fields)
+    
+    return variants
+
+def with_fresh_ids(questions: List[dict]) -> List[dict]:
+    """Copy a question set with new ids so cached sets are never shared between quizzes"""
+    return [{**q, "id": secrets.token_hex(4)} for q in questions]
+
+def live_quiz_sets(key: tuple) -> list:
+    """Return the bucket's unexpired (expires_at, questions) pairs, pruning the rest"""
+    pool = quiz_cache.get(key)
+    if pool is None:
+        return []
+    now = time.monotonic()
+    live = [entry for entry in pool if entry[0] > now]
+    if len(live) != len(pool):
+        quiz_cache[key] = live
+    return live
+
+def add_to_quiz_cache(key: tuple, variants: List[List[dict]]):
+    pool = live_quiz_sets(key)
+    expires_at = time.monotonic() + QUIZ_SET_TTL_SECONDS
+    quiz_cache[key] = pool + [(expires_at, v) for v in variants[:QUIZ_CACHE_MAX_SETS - len(pool)]]
+
+async def refill_quiz_cache(key: tuple):
+    try:
+        variants = await request_quiz_questions(*key)
+    except Exception as e:
+        print(f"Quiz cache refill failed: {e}")
+        return
+    finally:
+        quiz_cache_refills.discard(key)
+    add_to_quiz_cache(key, variants)
+
+def schedule_quiz_cache_refill(key: tuple):
+    if key in quiz_cache_refills:
+        return
+    quiz_cache_refills.add(key)
+    task = asyncio.create_task(refill_quiz_cache(key))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+async def generate_quiz_questions(category: str, difficulty: str, num_questions: int):
+    key = (category, difficulty, num_questions)
+    lock = quiz_cache_locks.get(key)
+    if lock is None:
+        lock = quiz_cache_locks[key] = asyncio.Lock()
+    
+    async with lock:
+        pool = live_quiz_sets(key)
+        if len(pool) >= QUIZ_CACHE_MIN_SETS:
+            if len(pool) < QUIZ_CACHE_MAX_SETS and random.random() < QUIZ_CACHE_REFILL_PROBABILITY:
+                schedule_quiz_cache_refill(key)
+            return with_fresh_ids(random.choice(pool)[1])
+        
+        # Requests queued behind a failed generation don't each retry the provider
+        if key in quiz_generation_failures:
+            return generate_fallback_questions(category, difficulty, num_questions)
         
-        # Parse the AI response
         try:
-            questions = json.loads(response.strip())
-            if not isinstance(questions, list):
-                raise ValueError("Response is not a list")
-            
-            # Assign points based on difficulty
-            points_map = {"Easy": 10, "Medium": 20, "Hard": 30}
-            for q in questions:
-                q["points"] = points_map.get(difficulty, 10)
-                q["category"] = category
-                q["difficulty"] = difficulty
-            
-            return questions
-        except json.JSONDecodeError:
-            # Fallback questions if AI response fails
+            variants = await request_quiz_questions(category, difficulty, num_questions)
+        except Exception as e:
+            print(f"AI generation failed: {e}")
+            if is_transient_llm_error(e):
+                # Retries are exhausted, so treat the provider as down for this bucket
+                quiz_generation_failures[key] = time.time()
             return generate_fallback_questions(category, difficulty, num_questions)
-            
-    except Exception as e:
-        print(f"AI generation failed: {e}")
-        return generate_fallback_questions(category, difficulty, num_questions)
+        
+        add_to_quiz_cache(key, variants)
+        return with_fresh_ids(variants[0])
 
 def generate_fallback_questions(category: str, difficulty: str, num_questions: int):
     """Fallback questions in case AI fails"""
-    points_map = {"Easy": 10, "Medium": 20, "Hard": 30}
-    points = points_map.get(difficulty, 10)
+    points = POINTS_MAP.get(difficulty, 10)
     
     questions = []
     for i in range(num_questions):
@@ -152,33 +411,76 @@ def generate_fallback_questions(category: str, difficulty: str, num_questions: i
         })
     return questions
 
+@app.on_event("startup")
+async def warm_mongo_pool():
+    # Establish the pool before the first request pays the handshake
+    await db.command("ping")
+
+@app.on_event("startup")
+async def create_indexes():
+    await db.users.create_index("email", unique=True)
+    await db.users.create_index("user_id", unique=True)
+    await db.users.create_index([("total_points", -1)])
+    await db.quizzes.create_index([("quiz_id", 1)], unique=True)
+    await db.quizzes.create_index([("user_id", 1), ("completed", 1), ("completed_at", -1), ("quiz_id", -1)])
+
+async def refresh_stats():
+    total_users, total_quizzes = await asyncio.gather(
+        db.users.estimated_document_count(),
+        db.quizzes.count_documents({"completed": True})
+    )
+    app_stats.update(total_users=total_users, total_quizzes=total_quizzes, ts=time.time())
+
+async def refresh_stats_loop():
+    while True:
+        try:
+            await refresh_stats()
+        except Exception as e:
+            print(f"Stats refresh failed: {e}")
+        await asyncio.sleep(STATS_REFRESH_SECONDS)
+
+@app.on_event("startup")
+async def start_stats_refresh():
+    background_tasks.add(asyncio.create_task(refresh_stats_loop()))
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    for task in background_tasks:
+        task.cancel()
+
 # API Routes
 @app.get("/api/health")
 async def health_check():
     return {"status": "healthy", "service": "AI Quiz Pro API"}
 
 @app.post("/api/auth/register")
-async def register_user(user_data: UserRegistration):
+async def register_user(user_data: UserRegistration = Depends(json_body(UserRegistration))):
     # Check if user exists
-    existing_user = await db.users.find_one({"email": user_data.email})
+    existing_user = await db.users.find_one({"email": user_data.email}, {"_id": 1})
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    user_id = str(uuid.uuid4())
+    user_id = secrets.token_hex(16)
+    salt = secrets.token_bytes(16)
     user_doc = {
         "user_id": user_id,
         "email": user_data.email,
-        "password": hash_password(user_data.password),
+        "password": await run_password_task(hash_password, user_data.password, salt),
+        "salt": salt.hex(),
         "full_name": user_data.full_name,
         "total_points": 0,
         "wallet_balance": 0.0,
-        "created_at": datetime.utcnow(),
+        "created_at": datetime.now(timezone.utc),
         "total_quizzes": 0,
         "correct_answers": 0,
         "is_verified": False
     }
     
-    await db.users.insert_one(user_doc)
+    try:
+        await db.users.insert_one(user_doc)
+    except DuplicateKeyError:
+        # Lost a race with a concurrent registration for the same email
+        raise HTTPException(status_code=400, detail="Email already registered")
     token = generate_token(user_id)
     
     return {
@@ -194,11 +496,20 @@ async def register_user(user_data: UserRegistration):
     }
 
 @app.post("/api/auth/login")
-async def login_user(login_data: UserLogin):
-    user = await db.users.find_one({"email": login_data.email})
-    if not user or user["password"] != hash_password(login_data.password):
+async def login_user(login_data: UserLogin = Depends(json_body(UserLogin))):
+    user = await db.users.find_one({"email": login_data.email}, USER_LOGIN_PROJECTION)
+    if not user or not await run_password_task(verify_password, login_data.password, user):
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
+    if "salt" not in user:
+        # Upgrade legacy SHA-256 hashes to scrypt now that we have the plaintext
+        salt = secrets.token_bytes(16)
+        password_hash = await run_password_task(hash_password, login_data.password, salt)
+        await db.users.update_one(
+            {"user_id": user["user_id"], "salt": {"$exists": False}},
+            {"$set": {"password": password_hash, "salt": salt.hex()}}
+        )
+    
     token = generate_token(user["user_id"])
     
     return {
@@ -226,79 +537,70 @@ async def get_user_profile(current_user = Depends(get_current_user)):
     }
 
 @app.get("/api/quiz/categories")
-async def get_quiz_categories():
-    return {
-        "categories": [
-            "General Knowledge",
-            "Science & Technology", 
-            "History",
-            "Geography",
-            "Sports",
-            "Entertainment",
-            "Literature",
-            "Mathematics",
-            "Current Affairs",
-            "Art & Culture"
-        ]
-    }
+async def get_quiz_categories(if_none_match: Optional[str] = Header(None)):
+    if if_none_match is not None and etag_matches(if_none_match, CATEGORIES_HEADERS["ETag"]):
+        return Response(status_code=304, headers=CATEGORIES_HEADERS)
+    return Response(CATEGORIES_BYTES, media_type="application/json", headers=CATEGORIES_HEADERS)
 
 @app.post("/api/quiz/generate")
-async def generate_quiz(quiz_request: QuizRequest, current_user = Depends(get_current_user)):
+async def generate_quiz(quiz_request: QuizRequest = Depends(json_body(QuizRequest)), user_id: str = Depends(get_current_user_id)):
     questions = await generate_quiz_questions(
         quiz_request.category,
         quiz_request.difficulty,
         quiz_request.num_questions
     )
     
-    quiz_id = str(uuid.uuid4())
+    # Sum points and strip correct answers from the client copy in one pass
+    total_points = 0
+    questions_for_client = []
+    for q in questions:
+        total_points += q["points"]
+        questions_for_client.append({k: v for k, v in q.items() if k not in HIDDEN_QUESTION_FIELDS})
+    
+    quiz_id = secrets.token_hex(16)
     quiz_doc = {
         "quiz_id": quiz_id,
-        "user_id": current_user["user_id"],
+        "user_id": user_id,
         "category": quiz_request.category,
         "difficulty": quiz_request.difficulty,
         "questions": questions,
-        "created_at": datetime.utcnow(),
+        "created_at": datetime.now(timezone.utc),
         "completed": False,
         "score": 0,
-        "total_points": sum(q["points"] for q in questions)
+        "total_points": total_points
     }
     
     await db.quizzes.insert_one(quiz_doc)
     
-    # Remove correct answers from response
-    questions_for_client = []
-    for q in questions:
-        q_copy = q.copy()
-        del q_copy["correct_answer"]
-        del q_copy["explanation"]
-        questions_for_client.append(q_copy)
-    
     return {
         "quiz_id": quiz_id,
         "category": quiz_request.category,
         "difficulty": quiz_request.difficulty,
         "questions": questions_for_client,
-        "time_limit": quiz_request.num_questions * 30,  # 30 seconds per question
-        "total_possible_points": sum(q["points"] for q in questions)
+        "time_limit": quiz_request.num_questions * TIME_PER_QUESTION,
+        "total_possible_points": total_points
     }
 
 @app.post("/api/quiz/submit")
-async def submit_quiz(submission: QuizSubmission, current_user = Depends(get_current_user)):
+async def submit_quiz(submission: QuizSubmission = Depends(json_body(QuizSubmission)), user_id: str = Depends(get_current_user_id)):
     # Get the quiz
-    quiz = await db.quizzes.find_one({"quiz_id": submission.quiz_id, "user_id": current_user["user_id"]})
+    quiz = await db.quizzes.find_one({"quiz_id": submission.quiz_id, "user_id": user_id})
     if not quiz:
         raise HTTPException(status_code=404, detail="Quiz not found")
     
     if quiz["completed"]:
         raise HTTPException(status_code=400, detail="Quiz already completed")
     
+    questions_by_id = {q["id"]: q for q in quiz["questions"]}
+    total_questions = len(quiz["questions"])
+    
     # Calculate score
     total_score = 0
     correct_count = 0
     results = []
     
     for answer in submission.answers:
-        question = next((q for q in quiz["questions"] if q["id"] == answer.question_id), None)
+        question = questions_by_id.get(answer.question_id)
         if not question:
             continue
             
@@ -321,23 +623,25 @@ async def submit_quiz(submission: QuizSubmission, current_user = Depends(get_cur
             "time_taken": answer.time_taken
         })
     
-    # Update quiz as completed
-    await db.quizzes.update_one(
-        {"quiz_id": submission.quiz_id},
+    # Only the request that flips the quiz to completed may credit the user
+    marked = await db.quizzes.update_one(
+        {"quiz_id": submission.quiz_id, "completed": False},
         {
             "$set": {
                 "completed": True,
                 "score": total_score,
                 "correct_answers": correct_count,
-                "completed_at": datetime.utcnow(),
+                "completed_at": datetime.now(timezone.utc),
                 "results": results
             }
         }
     )
+    if marked.modified_count != 1:
+        raise HTTPException(status_code=400, detail="Quiz already completed")
     
     # Update user stats
     await db.users.update_one(
-        {"user_id": current_user["user_id"]},
+        {"user_id": user_id},
         {
             "$inc": {
                 "total_points": total_score,
@@ -347,67 +651,75 @@ async def submit_quiz(submission: QuizSubmission, current_user = Depends(get_cur
             }
         }
     )
+    user_cache.pop(user_id, None)
     
     return {
         "quiz_id": submission.quiz_id,
         "total_score": total_score,
         "correct_answers": correct_count,
-        "total_questions": len(quiz["questions"]),
-        "accuracy": (correct_count / len(quiz["questions"])) * 100,
+        "total_questions": total_questions,
+        "accuracy": (correct_count / total_questions) * 100,
         "points_earned": total_score,
         "money_earned": total_score * 0.01,
         "results": results
     }
 
 @app.get("/api/leaderboard")
-async def get_leaderboard(limit: int = 10):
-    leaders = await db.users.find(
+async def get_leaderboard(limit: int = Query(10, ge=1, le=100)):
+    cursor = db.users.find(
         {},
-        {"full_name": 1, "total_points": 1, "total_quizzes": 1, "wallet_balance": 1}
-    ).sort("total_points", -1).limit(limit).to_list(length=limit)
+        {"_id": 0, "full_name": 1, "total_points": 1, "total_quizzes": 1, "wallet_balance": 1}
+    ).sort("total_points", -1).limit(limit)
     
-    leaderboard = []
-    for i, leader in enumerate(leaders):
-        leaderboard.append({
+    leaderboard = [
+        {
             "rank": i + 1,
             "full_name": leader["full_name"],
             "total_points": leader.get("total_points", 0),
             "total_quizzes": leader.get("total_quizzes", 0),
             "wallet_balance": leader.get("wallet_balance", 0.0)
-        })
+        }
+        async for i, leader in aenumerate(cursor)
+    ]
     
     return {"leaderboard": leaderboard}
 
 @app.get("/api/user/history")
-async def get_quiz_history(current_user = Depends(get_current_user), limit: int = 20):
-    try:
-        history = await db.quizzes.find(
-            {"user_id": current_user["user_id"], "completed": True},
-            {"quiz_id": 1, "category": 1, "difficulty": 1, "score": 1, "correct_answers": 1, "completed_at": 1}
-        ).sort([("completed_at", -1)]).limit(limit).to_list(length=limit)
-        
-        return {"history": history}
-    except Exception as e:
-        print(f"History endpoint error: {e}")
-        # Fallback without sorting if completed_at is missing
-        try:
-            history = await db.quizzes.find(
-                {"user_id": current_user["user_id"], "completed": True},
-                {"quiz_id": 1, "category": 1, "difficulty": 1, "score": 1, "correct_answers": 1}
-            ).limit(limit).to_list(length=limit)
-            return {"history": history}
-        except Exception as e2:
-            print(f"Fallback history error: {e2}")
-            return {"history": []}
+async def get_quiz_history(
+    user_id: str = Depends(get_current_user_id),
+    limit: int = Query(20, ge=1),
+    before: Optional[datetime] = None,
+    before_id: Optional[str] = None
+):
+    # Keyset pagination: pass the previous page's next_before/next_before_id to continue from there.
+    # quiz_id breaks ties between quizzes completed at the same instant.
+    query = {"user_id": user_id, "completed": True}
+    if before is not None:
+        if before_id is None:
+            query["completed_at"] = {"$lt": before}
+        else:
+            query["$or"] = [
+                {"completed_at": {"$lt": before}},
+                {"completed_at": before, "quiz_id": {"$lt": before_id}}
+            ]
+    cursor = db.quizzes.find(
+        query,
+        {"_id": 0, "quiz_id": 1, "category": 1, "difficulty": 1, "score": 1, "correct_answers": 1, "completed_at": 1}
+    ).sort([("completed_at", -1), ("quiz_id", -1)]).limit(limit)
+    
+    history = [quiz async for quiz in cursor]
+    last = history[-1] if history and len(history) == limit else None
+    return {
+        "history": history,
+        "next_before": last["completed_at"] if last else None,
+        "next_before_id": last["quiz_id"] if last else None
+    }
 
 @app.get("/api/stats")
 async def get_app_stats():
-    total_users = await db.users.count_documents({})
-    total_quizzes = await db.quizzes.count_documents({"completed": True})
-    
     return {
-        "total_users": total_users,
-        "total_quizzes": total_quizzes,
+        "total_users": app_stats["total_users"],
+        "total_quizzes": app_stats["total_quizzes"],
         "app_name": "AI Quiz Pro",
         "version": "1.0.0"
     }
@@ -0,0 +1,214 @@
+import asyncio
+import hashlib
+import os
+import sys
+import types
+
+import pytest
+
+os.environ.setdefault("JWT_SECRET", "test-secret")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
+
+try:
+    import emergentintegrations.llm.chat  # noqa: F401
+except ImportError:
+    # The LLM SDK is a private package; these tests never call it, so a stub is enough to import the server
+    chat_module = types.ModuleType("emergentintegrations.llm.chat")
+    chat_module.LlmChat = type("LlmChat", (), {})
+    chat_module.UserMessage = type("UserMessage", (), {})
+    sys.modules["emergentintegrations"] = types.ModuleType("emergentintegrations")
+    sys.modules["emergentintegrations.llm"] = types.ModuleType("emergentintegrations.llm")
+    sys.modules["emergentintegrations.llm.chat"] = chat_module
+
+import server  # noqa: E402
+
+
+def make_question(qid="q0", **overrides):
+    question = {
+        "id": qid,
+        "question": f"Question {qid}?",
+        "options": ["A", "B", "C", "D"],
+        "correct_answer": 1,
+        "explanation": "Because B.",
+    }
+    question.update(overrides)
+    return question
+
+
+def make_questions(n, prefix="q"):
+    return [make_question(f"{prefix}{i}") for i in range(n)]
+
+
+def test_split_question_sets_grouped():
+    sets = [make_questions(3, "a"), make_questions(3, "b")]
+    assert server.split_question_sets(sets, 3) == sets
+
+
+def test_split_question_sets_flat_single_set():
+    flat = make_questions(3)
+    assert server.split_question_sets(flat, 3) == [flat]
+
+
+def test_split_question_sets_flat_multiple_sets():
+    flat = make_questions(9)
+    assert server.split_question_sets(flat, 3) == [flat[0:3], flat[3:6], flat[6:9]]
+
+
+def test_split_question_sets_drops_incomplete_sets():
+    flat = make_questions(7)
+    assert server.split_question_sets(flat, 3) == [flat[0:3], flat[3:6]]
+    grouped = [make_questions(3, "a"), make_questions(2, "b"), "junk"]
+    assert server.split_question_sets(grouped, 3) == [grouped[0]]
+
+
+@pytest.mark.parametrize("overrides", [
+    {"question": None},
+    {"options": ["A", "B", "C"]},
+    {"options": ["A", "B", "C", 4]},
+    {"correct_answer": "1"},
+    {"correct_answer": 4},
+    {"correct_answer": True},
+    {"explanation": None},
+])
+def test_split_question_sets_drops_sets_with_malformed_questions(overrides):
+    good = make_questions(3, "a")
+    bad = make_questions(2, "b") + [make_question("b2", **overrides)]
+    assert server.split_question_sets([good, bad], 3) == [good]
+
+
+def test_split_question_sets_drops_questions_missing_fields():
+    incomplete = make_questions(3)
+    del incomplete[1]["explanation"]
+    with pytest.raises(ValueError):
+        server.split_question_sets(incomplete, 3)
+
+
+@pytest.mark.parametrize("parsed", [{"questions": []}, [], make_questions(2), [make_questions(2)]])
+def test_split_question_sets_rejects_unusable_responses(parsed):
+    with pytest.raises(ValueError):
+        server.split_question_sets(parsed, 3)
+
+
+@pytest.mark.parametrize("num_questions", [0, -1, server.MAX_QUESTIONS_PER_QUIZ + 1])
+def test_quiz_request_rejects_out_of_range_num_questions(num_questions):
+    body = server.orjson.dumps({"category": "History", "difficulty": "Easy", "num_questions": num_questions})
+    with pytest.raises(server.msgspec.ValidationError):
+        server.msgspec.json.decode(body, type=server.QuizRequest)
+
+
+@pytest.mark.parametrize("header, expected", [
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"xyz", W/"abc"', True),
+    ("*", True),
+    ('"xyz"', False),
+    ('"ab"', False),
+])
+def test_etag_matches(header, expected):
+    assert server.etag_matches(header, '"abc"') is expected
+
+
+class FakeUsers:
+    def __init__(self, user):
+        self.user = user
+        self.updates = []
+
+    async def find_one(self, query, projection=None):
+        return dict(self.user) if self.user["email"] == query["email"] else None
+
+    async def update_one(self, query, update):
+        self.updates.append((query, update))
+        self.user.update(update["$set"])
+
+
+def login(monkeypatch, user, password):
+    users = FakeUsers(user)
+    monkeypatch.setattr(server, "db", types.SimpleNamespace(users=users))
+    response = asyncio.run(server.login_user(server.UserLogin(email=user["email"], password=password)))
+    return response, users
+
+
+def salted_user(password):
+    salt = os.urandom(16)
+    return {
+        "user_id": "u1", "email": "a@example.com", "full_name": "A",
+        "password": server.hash_password(password, salt), "salt": salt.hex(),
+    }
+
+
+def legacy_user(password):
+    return {
+        "user_id": "u1", "email": "a@example.com", "full_name": "A",
+        "password": hashlib.sha256(password.encode()).hexdigest(),
+    }
+
+
+def test_hash_password_depends_on_salt():
+    assert server.hash_password("secret", b"a" * 16) == server.hash_password("secret", b"a" * 16)
+    assert server.hash_password("secret", b"a" * 16) != server.hash_password("secret", b"b" * 16)
+
+
+def test_verify_password_salted():
+    user = salted_user("secret")
+    assert server.verify_password("secret", user)
+    assert not server.verify_password("wrong", user)
+
+
+def test_verify_password_legacy_sha256():
+    user = legacy_user("secret")
+    assert server.verify_password("secret", user)
+    assert not server.verify_password("wrong", user)
+
+
+def test_login_rehashes_legacy_password_once(monkeypatch):
+    user = legacy_user("secret")
+    response, users = login(monkeypatch, user, "secret")
+    assert response["user"]["user_id"] == "u1"
+    assert len(users.updates) == 1
+    query, _ = users.updates[0]
+    assert query == {"user_id": "u1", "salt": {"$exists": False}}
+    assert "salt" in user
+    assert server.verify_password("secret", user)
+    assert not server.verify_password("wrong", user)
+
+    _, users = login(monkeypatch, user, "secret")
+    assert users.updates == []
+
+
+def test_login_does_not_rehash_salted_password(monkeypatch):
+    _, users = login(monkeypatch, salted_user("secret"), "secret")
+    assert users.updates == []
+
+
+def test_login_rejects_wrong_password(monkeypatch):
+    with pytest.raises(server.HTTPException) as exc:
+        login(monkeypatch, legacy_user("secret"), "wrong")
+    assert exc.value.status_code == 401
+
+
+def current_user_id(token):
+    credentials = server.HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+    return asyncio.run(server.get_current_user_id(credentials))
+
+
+def test_token_round_trip():
+    assert current_user_id(server.generate_token("u1")) == "u1"
+
+
+@pytest.mark.parametrize("token", [
+    server.jwt.encode({"uid": "u1", "exp": 4102444800}, "other-secret", algorithm="HS256"),
+    server.jwt.encode({"uid": "u1", "exp": 1}, server.JWT_SECRET, algorithm="HS256"),
+    "not-a-token",
+])
+def test_invalid_tokens_are_rejected(token):
+    with pytest.raises(server.HTTPException) as exc:
+        current_user_id(token)
+    assert exc.value.status_code == 401
+
+
+def test_tampered_payload_is_rejected():
+    header, _, signature = server.generate_token("u1").split(".")
+    forged_payload = server.generate_token("u2").split(".")[1]
+    with pytest.raises(server.HTTPException) as exc:
+        current_user_id(f"{header}.{forged_payload}.{signature}")
+    assert exc.value.status_code == 401